@@ -8,21 +8,63 @@
 Sanitize text to be safely printed on the terminal.
 """
 
-import argparse
+import functools
 import re
 import sys
-from typing import Optional, Pattern
+from typing import Optional, Pattern, Sequence
+
+
+## Printable ASCII, newline and tab, everything else (ESC included) is
+## redacted.
+_SAFE_TABLE = bytes(char if char in (0x09, 0x0a) or 0x20 <= char <= 0x7e
+                    else ord("_") for char in range(0x100))
+## Same as above but keeping ESC, which must then be validated as an SGR.
+_SGR_SAFE_TABLE = _SAFE_TABLE[:0x1b] + b"\x1b" + _SAFE_TABLE[0x1c:]
+## In valid UTF-8, continuation bytes always follow a leading byte, deleting
+## them leaves the leading byte alone to be redacted, a single underscore per
+## code point.
+_UTF8_CONTINUATION = bytes(range(0x80, 0xc0))
+## With invalid UTF-8, only complete code points are replaced before
+## translating, any other byte outside ASCII is redacted on its own. Surrogates
+## are accepted as stprint() encodes them with "surrogatepass".
+_UTF8_SEQUENCE = re.compile(
+    rb"[\xc2-\xdf][\x80-\xbf]"
+    rb"|\xe0[\xa0-\xbf][\x80-\xbf]|[\xe1-\xef][\x80-\xbf]{2}"
+    rb"|\xf0[\x90-\xbf][\x80-\xbf]{2}|[\xf1-\xf3][\x80-\xbf]{3}"
+    rb"|\xf4[\x80-\x8f][\x80-\xbf]{2}")
+
+
+## Assembled once, get_color_pattern() only fills the exclusion lookahead in
+## place of the _EXCLUDE placeholder.
+##
+## Each parameter can only be consumed by one part of the pattern, so a
+## failed match is rejected in linear time instead of trying every way of
+## splitting semicolons between nested repetitions.
+_EXCLUDE = "{EXCLUDE}"
+## Multi digit numbers are tried first, a single digit only matches when it is
+## the whole parameter, so trying it first mostly leads to backtracking.
+## TODO: verify which attributes should stay.
+_SGR_4BIT_CODE = (rf"{_EXCLUDE}"
+                  r"(2[1-57-9]|3[0-79]|4[0-79]|9[0-7]|10[0-7]|[0-9])")
+_EIGHT_BIT = r"(2[0-4][0-9]|25[0-5]|[0-1]?[0-9]?[0-9])"
+_SGR_8BIT = rf"[3-4]8;5;{_EIGHT_BIT}"
+_SGR_24BIT = rf"[3-4]8;2;{_EIGHT_BIT};{_EIGHT_BIT};{_EIGHT_BIT}"
+_SGR_EXTRA = rf"{_EXCLUDE}({_SGR_8BIT}|{_SGR_24BIT})"
+_SGR_TEMPLATE = rf";*({_SGR_4BIT_CODE}(;{_SGR_4BIT_CODE})*)?m"
+_SGR_EXTRA_TEMPLATE = (rf"{_SGR_TEMPLATE}|"
+                       rf";*({_SGR_4BIT_CODE};+)*{_SGR_EXTRA}"
+                       rf"((;+{_SGR_4BIT_CODE})+|;*)m")
 
 
 def exclude_pattern(original_pattern: str,
-                    negate_pattern: list[str]) -> str:
+                    negate_pattern: Sequence[str]) -> str:
     """Exclude matching next expression if provided expression matches.
 
     Parameters
     ----------
     original_pattern : str
         Pattern which contains unwanted matches.
-    negate_pattern : list[str]
+    negate_pattern : Sequence[str]
         Pattern to exclude from the next match.
 
     Returns
@@ -35,14 +77,21 @@ def exclude_pattern(original_pattern: str,
     Redact unsafe sequences by default:
     >>> color_pattern = exclude_pattern(r"(30|31)", ["31"])
     '(?!(?:31))(30|31)'
+
+    Nothing is excluded without a pattern to negate:
+    >>> color_pattern = exclude_pattern(r"(30|31)", [])
+    '(30|31)'
     """
+    if not negate_pattern:
+        return original_pattern
     exclude_pattern_str = "|".join(map(re.escape, negate_pattern))
     exclude_pattern_str = rf"(?!(?:{exclude_pattern_str}))"
     return rf"{exclude_pattern_str}{original_pattern}"
 
 
+@functools.lru_cache(maxsize=32)
 def get_color_pattern(extra_colors: Optional[bool],
-                      exclude_colors: Optional[list[str]]
+                      exclude_colors: Optional[tuple[str, ...]]
                       ) -> Pattern[str]:
     """Print compiled RegEx for SGR sequences
 
@@ -72,11 +121,14 @@ def get_color_pattern(extra_colors: Optional[bool],
     -  8-bit SGR: (4-bit;+)?[3-4]8;5;<0-255>(;+4-bit)*m
     - 24-bit SGR: (4-bit;+)?[3-4]8;2;<0-255>;<0-255>;<0-255>(;+4-bit)*m
 
+    The compiled pattern is cached per configuration, arguments must be
+    hashable.
+
     Parameters
     ----------
     extra_colors : Optional[bool]
         Whether to allow extra colors or not.
-    exclude_colors : Optional[list[str]]
+    exclude_colors : Optional[tuple[str, ...]]
         Color codes to be excluded.
 
     Returns
@@ -96,21 +148,108 @@ def get_color_pattern(extra_colors: Optional[bool],
     >>> color_pattern = exclude_pattern(r"(3[0-7])", ["30"])
     '(?!(?:31))3[0-7]'
     """
-    ## TODO: verify which attributes should stay.
-    sgr_4bit = r"([0-9]|2[1-5]|2[7-9]|3[0-7]|39|4[0-7]|49|9[0-7]|10[0-7])"
-    if exclude_colors:
-        sgr_4bit = exclude_pattern(sgr_4bit, exclude_colors)
-    sgr_4bit = rf";*{sgr_4bit}(;{sgr_4bit})*"
-    sgr_re = rf"(;*|{sgr_4bit})?m"
-    if extra_colors:
-        eight_bit = r"([0-1]?[0-9]?[0-9]|2[0-4][0-9]|25[0-5])"
-        sgr_8bit = rf"[3-4]8;5;{eight_bit}"
-        sgr_24bit = rf"[3-4]8;2;{eight_bit};{eight_bit};{eight_bit}"
-        sgr_extra = rf"({sgr_8bit}|{sgr_24bit})"
+    exclude = exclude_pattern("", exclude_colors or ())
+    sgr_re = _SGR_EXTRA_TEMPLATE if extra_colors else _SGR_TEMPLATE
+    return re.compile(sgr_re.replace(_EXCLUDE, exclude))
+
+
+@functools.lru_cache(maxsize=32)
+def get_escape_pattern(extra_colors: Optional[bool],
+                       exclude_colors: Optional[tuple[str, ...]]
+                       ) -> Pattern[bytes]:
+    """Print compiled RegEx for ESC not starting an allowed SGR sequence.
+
+    Parameters
+    ----------
+    extra_colors : Optional[bool]
+        Whether to allow extra colors or not.
+    exclude_colors : Optional[tuple[str, ...]]
+        Color codes to be excluded.
+
+    Returns
+    -------
+    Pattern[bytes]
+        Compiled regular expression with negative lookahead.
+
+    Examples
+    --------
+    Match the ESC that does not start a color:
+    >>> get_escape_pattern(True, None).sub(b"_", b"\\x1b[31m\\x1b[2J")
+    b'\\x1b[31m_[2J'
+    """
+    sgr_pattern = get_color_pattern(extra_colors=extra_colors,
+                                    exclude_colors=exclude_colors)
+    ## Every SGR starts with a digit, a semicolon or the terminator, checking
+    ## it first rejects other CSI sequences without trying each alternative.
+    escape_re = rf"\x1b(?!\[(?=[0-9;m])(?:{sgr_pattern.pattern}))"
+    ## Excluded codes may be any text, those outside ASCII never match.
+    return re.compile(escape_re.encode("utf-8"))
+
+
+## Compiled on import for the default arguments of stprint_bytes(), which
+## don't need a cache lookup.
+_DEFAULT_ESCAPE_PATTERN = get_escape_pattern(True, None)
+
+
+def stprint_bytes(untrusted_bytes: bytes,
+                  colors: Optional[bool] = True,
+                  extra_colors: Optional[bool] = True,
+                  exclude_colors: Optional[list[str]] = None,
+                  ) -> bytes:
+    """Sanitize untrusted UTF-8 encoded text to be printed to the terminal.
+
+    Same as stprint() but without decoding and encoding the text. Each UTF-8
+    encoded code point not allowed is redacted to a single underscore, any
+    other byte outside ASCII, such as invalid UTF-8, is redacted on its own.
+
+    Parameters
+    ----------
+    untrusted_bytes : bytes
+        The unsafe UTF-8 encoded text to be sanitized.
+    colors : Optional[bool] = True
+        Whether to allow colors or not.
+    extra_colors : Optional[bool] = True
+        Whether to allow extra colors or not.
+    exclude_colors : Optional[list[str]] = None
+        Color codes to be excluded.
+
+    Returns
+    -------
+    bytes
+        Sanitized ASCII text.
+
+    Examples
+    --------
+    Redact unsafe sequences by default:
+    >>> stprint_bytes(b"\\x1b[2J\\x1b[31mvulnerable: \\xc3\\xb6\\x07")
+    b'_[2J\\x1b[31mvulnerable: __'
+    """
+    ## Continuation bytes are only deleted when each one belongs to a code
+    ## point, a stray one could otherwise join an ESC to the characters after
+    ## it. Decoding is the fastest way to validate the whole text.
+    delete = b""
+    if not untrusted_bytes.isascii():
+        try:
+            untrusted_bytes.decode("utf-8", "surrogatepass")
+            delete = _UTF8_CONTINUATION
+        except UnicodeDecodeError:
+            untrusted_bytes = _UTF8_SEQUENCE.sub(b"_", untrusted_bytes)
+    if not colors or b"\x1b" not in untrusted_bytes:
+        return untrusted_bytes.translate(_SAFE_TABLE, delete)
+
+    if extra_colors and not exclude_colors:
+        escape_pattern = _DEFAULT_ESCAPE_PATTERN
+    else:
         if exclude_colors:
-            sgr_extra = exclude_pattern(sgr_extra, exclude_colors)
-        sgr_re = rf"{sgr_re}|({sgr_4bit};+)*;*{sgr_extra};*(;+{sgr_4bit})*m"
-    return re.compile(sgr_re)
+            exclude_key = tuple(sorted(frozenset(exclude_colors)))
+        else:
+            exclude_key = None
+        escape_pattern = get_escape_pattern(bool(extra_colors), exclude_key)
+
+    ## An SGR is made only of printable characters, translating before
+    ## validating it can't turn an invalid sequence into a valid one.
+    return escape_pattern.sub(
+        b"_", untrusted_bytes.translate(_SGR_SAFE_TABLE, delete))
 
 
 def stprint(untrusted_text: str,
@@ -155,29 +294,12 @@ def stprint(untrusted_text: str,
     ...            extra_colors=False)
     _[38;5;0m\x1b[31m_[38;2;0;0;0m
     """
-    allowed_space = {ord("\n"), ord("\t")}
-    if colors:
-        sgr_pattern = get_color_pattern(extra_colors=extra_colors,
-                                        exclude_colors=exclude_colors)
-    output = []
-    length = len(untrusted_text)
-    i = 0
-    while i < length:
-        char = untrusted_text[i]
-        hex_value = ord(char)
-        if 0x20 <= hex_value <= 0x7e or hex_value in allowed_space:
-            output.append(char)
-        elif (colors and hex_value == 0x1b and i + 1 < len(untrusted_text) and
-              untrusted_text[i + 1] == "[" and
-              (sgr_match := re.match(sgr_pattern, untrusted_text[i + 2:]))):
-            sgr_match_length = sgr_match.end()
-            output.append(untrusted_text[i:i + 2 + sgr_match_length])
-            i += sgr_match_length + 1
-        else:
-            output.append("_")
-        i += 1
-
-    return "".join(output)
+    ## Lone surrogates, such as undecodable bytes escaped by Python, are
+    ## encoded as any other code point and redacted the same way.
+    untrusted_bytes = untrusted_text.encode("utf-8", "surrogatepass")
+    return stprint_bytes(untrusted_bytes, colors=colors,
+                         extra_colors=extra_colors,
+                         exclude_colors=exclude_colors).decode("ascii")
 
 
 def main() -> None:
@@ -210,17 +332,21 @@ def main() -> None:
     $ sudo -- cat -- /untrusted/log | stprint.py
     $ stprint.py < <(sudo -- cat -- /untrusted/log)
     """
-    parser = argparse.ArgumentParser()
-    parser.add_argument("untrusted_text", nargs=argparse.REMAINDER,
-                        help="text to print safely")
-    args = parser.parse_args()
-
-    if args.untrusted_text:
-        untrusted_text = "".join(args.untrusted_text)
+    ## Without options every argument is text, which argparse would return as
+    ## is. Importing and building the parser only when needed saves most of
+    ## the start up time of short invocations.
+    args = sys.argv[1:]
+    if args and args[0].startswith("-") and args[0] != "-":
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument("untrusted_text", nargs=argparse.REMAINDER,
+                            help="text to print safely")
+        args = parser.parse_args(args).untrusted_text
+
+    if args:
+        print(stprint("".join(args)), end="")
     else:
-        untrusted_text = sys.stdin.read().strip("")
-
-    print(stprint(untrusted_text), end="")
+        sys.stdout.buffer.write(stprint_bytes(sys.stdin.buffer.read()))
 
 
 if __name__ == "__main__":
@@ -4,7 +4,7 @@ Test the stprint module.
 """
 
 import unittest
-from stprint import stprint
+from stprint import stprint, stprint_bytes
 
 
 class TestSafePrint(unittest.TestCase):
@@ -45,6 +45,7 @@ class TestSafePrint(unittest.TestCase):
             ("\u0061", "a"),
             ("\u00D6 or \u00F6", "_ or _"),
             ("Ö or ö", "_ or _"),
+            ("\u65e5 or \U0001F600", "_ or _"),
             ("\x1b]8;;", "_]8;;"),
             ("\u0061", "a"),
             ("a\x1b]8;;b", "a_]8;;b"),
@@ -77,6 +78,8 @@ class TestSafePrint(unittest.TestCase):
             ("\x1b[38;2;255;0;0;0m", "\x1b[38;2;255;0;0;0m"),
             ("\x1b[;38;2;255;0;0m", "\x1b[;38;2;255;0;0m"),
             ("\x1b[0;38;2;255;0;0m", "\x1b[0;38;2;255;0;0m"),
+            ("\x1b[31ma\x1b[2Kb\x1b[0m", "\x1b[31ma_[2Kb\x1b[0m"),
+            ("\x1b\x1b[31m\x1b", "_\x1b[31m_"),
         ]
         for text, result in cases:
             with self.subTest(text=text, result=result):
@@ -109,6 +112,7 @@ class TestSafePrint(unittest.TestCase):
             ("\x1b[31m", "_[31m"),
             ("\x1b[38;5;1m", "_[38;5;1m"),
             ("\x1b[38;2;255;0;0m", "_[38;2;255;0;0m"),
+            ("a\x1b[31mb\x1b\a\n", "a_[31mb__\n"),
         ]
         for text, result in cases:
             with self.subTest(text=text, result=result):
@@ -141,5 +145,60 @@ class TestSafePrint(unittest.TestCase):
                                  result)
 
 
+    def test_stprint_backtracking(self) -> None:
+        """
+        Test invalid SGR with many parameters is rejected.
+        """
+        cases = [
+            ("\x1b[" + "1;" * 50 + "x", "_[" + "1;" * 50 + "x"),
+            ("\x1b[" + "1;;" * 50 + "38;5;1;" + "1;" * 50 + "x",
+             "_[" + "1;;" * 50 + "38;5;1;" + "1;" * 50 + "x"),
+            ("\x1b[" + "1;;" * 50 + "38;5;1" + ";1" * 50 + "m",
+             "\x1b[" + "1;;" * 50 + "38;5;1" + ";1" * 50 + "m"),
+        ]
+        for text, result in cases:
+            with self.subTest(text=text, result=result):
+                self.assertEqual(stprint(text, colors=True,
+                                            extra_colors=True,
+                                            exclude_colors=["30"]),
+                                 result)
+
+
+    def test_stprint_exclude_non_ascii(self) -> None:
+        """
+        Test excluded codes outside ASCII do not exclude any color.
+        """
+        cases = [
+            ("\x1b[31m", "\x1b[31m"),
+            ("\x1b[31m\xf6", "\x1b[31m_"),
+        ]
+        for text, result in cases:
+            with self.subTest(text=text, result=result):
+                self.assertEqual(stprint(text, colors=True,
+                                            extra_colors=True,
+                                            exclude_colors=["\xf6"]),
+                                 result)
+
+
+    def test_stprint_bytes(self) -> None:
+        """
+        Test UTF-8 encoded text.
+        """
+        cases = [
+            (b"a\n", b"a\n"),
+            (b"\x1b[31m\x1b[2K", b"\x1b[31m_[2K"),
+            (b"\xc3\x96 or \xc3\xb6", b"_ or _"),
+            (b"\xe6\x97\xa5 or \xf0\x9f\x98\x80", b"_ or _"),
+            (b"\xff or \x80", b"_ or _"),
+            (b"\x1b\x80[31mX", b"__[31mX"),
+            (b"25\xb0C", b"25_C"),
+            (b"\xe2\x82 or \xc3\xb6\x80", b"__ or __"),
+        ]
+        for text, result in cases:
+            with self.subTest(text=text, result=result):
+                self.assertEqual(stprint_bytes(text),
+                                 result)
+
+
 if __name__ == "__main__":
     unittest.main()